@@ -1,18 +1,30 @@
 import os
+import hmac
 import json
 import sqlite3
 import secrets
+import threading
+import time
 import functools
-import urllib.request
+import hashlib
 import urllib.parse
-from datetime import datetime
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 from pathlib import Path
 
 from flask import (
-    Flask, g, render_template, request, redirect, url_for,
-    session, flash, abort
+    Flask, g, render_template, stream_template, request, redirect, url_for,
+    session, flash, get_flashed_messages, abort
 )
-from werkzeug.security import generate_password_hash, check_password_hash
+import requests
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerificationError
+from cachelib.file import FileSystemCache
+from flask_session import Session
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from werkzeug.security import check_password_hash
 
 
 # =========================================================
@@ -22,44 +34,226 @@ BASE_DIR = Path(__file__).resolve().parent
 DB_PATH = Path(os.environ.get("DB_PATH") or (BASE_DIR / "library.db"))
 
 
+# セッションはサーバー側（ファイル）に置き、CookieにはセッションIDだけを載せる
+SESSION_DIR = Path(os.environ.get("SESSION_DIR") or (BASE_DIR / "flask_session"))
+
+
 app = Flask(__name__)
 # 本番では必ず環境変数で固定してください（毎回変わるとログインが飛びます）
 app.secret_key = os.environ.get("APP_SECRET") or secrets.token_urlsafe(48)
+app.config.update(
+    SESSION_TYPE="cachelib",
+    SESSION_CACHELIB=FileSystemCache(cache_dir=str(SESSION_DIR), threshold=10000),
+    SESSION_PERMANENT=False,
+)
+Session(app)
 
 
 # =========================================================
 # DB helpers
 # =========================================================
-def get_db() -> sqlite3.Connection:
-    if "db" not in g:
-        con = sqlite3.connect(DB_PATH)
+# 接続ごとに適用するPRAGMA（WALで読み書きを並行させ、commit毎のfsyncを減らす）
+SQLITE_PRAGMAS = """
+PRAGMA journal_mode=WAL;
+PRAGMA synchronous=NORMAL;
+PRAGMA busy_timeout=5000;
+PRAGMA cache_size=-20000;
+PRAGMA temp_store=MEMORY;
+PRAGMA foreign_keys=ON;
+PRAGMA mmap_size=268435456;
+"""
+
+
+# sqlite3 の接続ごとのプリペアドステートメントキャッシュ（既定は128）
+SQLITE_CACHED_STATEMENTS = 256
+
+
+def _apply_pragmas(con: sqlite3.Connection) -> None:
+    con.executescript(SQLITE_PRAGMAS)
+
+
+# 接続はワーカースレッドごとに1本ずつ持ち回す（リクエスト毎の open + PRAGMA を省く）
+_tls = threading.local()
+
+
+def get_db_ro() -> sqlite3.Connection:
+    """
+    読み取り専用接続（SELECTのみのルート用）。
+    reserved lock を取らないので書き込みと競合しません。
+    """
+    con = getattr(_tls, "db_ro", None)
+    if con is None:
+        con = sqlite3.connect(
+            f"file:{DB_PATH}?mode=ro", uri=True, isolation_level=None,
+            cached_statements=SQLITE_CACHED_STATEMENTS,
+        )
+        _apply_pragmas(con)
         con.row_factory = sqlite3.Row
-        g.db = con
-    return g.db
+        _tls.db_ro = con
+    return con
 
 
-@app.teardown_appcontext
-def close_db(exception=None):
-    db = g.pop("db", None)
-    if db is not None:
-        db.close()
+def get_db_rw() -> sqlite3.Connection:
+    """
+    書き込み用接続。最初の書き込みで BEGIN IMMEDIATE を発行し、
+    書き込み同士はきれいに直列化されます（SQLITE_BUSY を避ける）。
+    """
+    con = getattr(_tls, "db_rw", None)
+    if con is None:
+        con = sqlite3.connect(
+            DB_PATH, isolation_level="IMMEDIATE",
+            cached_statements=SQLITE_CACHED_STATEMENTS,
+        )
+        _apply_pragmas(con)
+        con.row_factory = sqlite3.Row
+        _tls.db_rw = con
+    return con
 
 
-def column_exists(cur: sqlite3.Cursor, table: str, col: str) -> bool:
-    cur.execute(f"PRAGMA table_info({table})")
-    return any(r["name"] == col for r in cur.fetchall())
+@app.teardown_appcontext
+def close_db(exception=None):
+    # 接続は閉じずに次のリクエストで再利用。
+    # 途中で例外になった書き込みだけは巻き戻して、次のリクエストに持ち越さない
+    con = getattr(_tls, "db_rw", None)
+    if con is not None and con.in_transaction:
+        con.rollback()
+
+
+# ---------------------------------------------------------
+# 毎リクエスト走るSQLは定数にして、同じ文字列で statement cache に当てる
+# ---------------------------------------------------------
+# 一覧・検索はキーセットページング（(updated_at, id) の続きから PAGE_SIZE 件）。
+# {after} の有無で2通りの文字列を起動時に作っておく。
+# index.html が next_url のリンクを出すまでは既定 0（=全件。LIMIT -1 で上限なし）
+BOOKS_PAGE_SIZE = int(os.environ.get("BOOKS_PAGE_SIZE") or 0)
+_BOOKS_AFTER = "AND (updated_at, id) < (?, ?)"
+
+_SQL_LIST_BOOKS = """
+SELECT * FROM books
+WHERE user_id=?
+  {after}
+ORDER BY updated_at DESC, id DESC
+LIMIT ?
+"""
+SQL_LIST_BOOKS = _SQL_LIST_BOOKS.format(after="")
+SQL_LIST_BOOKS_AFTER = _SQL_LIST_BOOKS.format(after=_BOOKS_AFTER)
+
+# FTS 側を先に1回だけ引いて rowid 集合にする（JOIN だと本1冊ごとに MATCH が走る）
+_SQL_SEARCH_BOOKS_FTS = """
+SELECT * FROM books
+WHERE user_id=?
+  AND id IN (SELECT rowid FROM books_fts WHERE books_fts MATCH ?)
+  {after}
+ORDER BY updated_at DESC, id DESC
+LIMIT ?
+"""
+SQL_SEARCH_BOOKS_FTS = _SQL_SEARCH_BOOKS_FTS.format(after="")
+SQL_SEARCH_BOOKS_FTS_AFTER = _SQL_SEARCH_BOOKS_FTS.format(after=_BOOKS_AFTER)
+
+_SQL_SEARCH_BOOKS_LIKE = """
+SELECT * FROM books
+WHERE user_id=?
+  AND (
+    title LIKE ?
+    OR authors LIKE ?
+    OR tags LIKE ?
+    OR isbn LIKE ?
+  )
+  {after}
+ORDER BY updated_at DESC, id DESC
+LIMIT ?
+"""
+SQL_SEARCH_BOOKS_LIKE = _SQL_SEARCH_BOOKS_LIKE.format(after="")
+SQL_SEARCH_BOOKS_LIKE_AFTER = _SQL_SEARCH_BOOKS_LIKE.format(after=_BOOKS_AFTER)
+
+# 場所履歴は id の降順でページング（?before_id=）
+HISTORY_PAGE_SIZE = 50
+
+_SQL_BOOK_HISTORY = """
+SELECT id, location, changed_at
+FROM book_locations
+WHERE book_id=? AND user_id=?
+  {before}
+ORDER BY id DESC
+LIMIT ?
+"""
+SQL_BOOK_HISTORY = _SQL_BOOK_HISTORY.format(before="")
+SQL_BOOK_HISTORY_BEFORE = _SQL_BOOK_HISTORY.format(before="AND id < ?")
+
+SQL_USER_BOOKS_REV = "SELECT books_rev FROM users WHERE id=?"
+
+SQL_GET_BOOK = "SELECT * FROM books WHERE id=? AND user_id=?"
+
+SQL_FIND_BOOK_BY_ISBN = "SELECT * FROM books WHERE user_id=? AND isbn=?"
+
+SQL_FIND_BOOK_ID_BY_ISBN = "SELECT id FROM books WHERE user_id=? AND isbn=?"
+
+
+def table_columns(cur: sqlite3.Cursor, table: str) -> set:
+    return {r["name"] for r in cur.execute(f"PRAGMA table_info({table})")}
+
+
+def existing_tables(cur: sqlite3.Cursor) -> set:
+    return {r["name"] for r in cur.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+
+
+# FTS5 が使えるか（init_db_and_migrate で確定）
+HAS_FTS = False
+
+# trigram は3文字未満の語を引けないので、それより短い検索は LIKE に回す
+FTS_MIN_QUERY_LEN = 3
+
+
+def _create_books_fts(cur: sqlite3.Cursor, tables: set) -> bool:
+    """
+    books を外部コンテンツとする FTS5 テーブルと同期トリガーを作ります。
+    FTS5 が組み込まれていない SQLite なら False（検索は LIKE のまま）。
+    """
+    created = "books_fts" not in tables
+    try:
+        cur.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5(
+          title, authors, tags, isbn,
+          content='books', content_rowid='id', tokenize='trigram'
+        )
+        """)
+    except sqlite3.OperationalError:
+        return False
 
+    cur.execute("""
+    CREATE TRIGGER IF NOT EXISTS books_fts_ai AFTER INSERT ON books BEGIN
+      INSERT INTO books_fts(rowid, title, authors, tags, isbn)
+      VALUES (new.id, new.title, new.authors, new.tags, new.isbn);
+    END
+    """)
+    cur.execute("""
+    CREATE TRIGGER IF NOT EXISTS books_fts_ad AFTER DELETE ON books BEGIN
+      INSERT INTO books_fts(books_fts, rowid, title, authors, tags, isbn)
+      VALUES ('delete', old.id, old.title, old.authors, old.tags, old.isbn);
+    END
+    """)
+    cur.execute("""
+    CREATE TRIGGER IF NOT EXISTS books_fts_au AFTER UPDATE ON books BEGIN
+      INSERT INTO books_fts(books_fts, rowid, title, authors, tags, isbn)
+      VALUES ('delete', old.id, old.title, old.authors, old.tags, old.isbn);
+      INSERT INTO books_fts(rowid, title, authors, tags, isbn)
+      VALUES (new.id, new.title, new.authors, new.tags, new.isbn);
+    END
+    """)
 
-def table_exists(cur: sqlite3.Cursor, table: str) -> bool:
-    cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (table,))
-    return cur.fetchone() is not None
+    # 既存DBに後から作った場合は、今ある本を索引に流し込む
+    if created:
+        cur.execute("INSERT INTO books_fts(books_fts) VALUES('rebuild')")
+    return True
 
 
 def init_db_and_migrate():
     """
     既存DBがあっても壊さず、足りないテーブル/カラムだけを補います。
     """
-    db = sqlite3.connect(DB_PATH)
+    db = sqlite3.connect(DB_PATH, isolation_level=None)
+    # WAL/SHM ファイルを起動時に作っておく
+    _apply_pragmas(db)
     db.row_factory = sqlite3.Row
     cur = db.cursor()
 
@@ -69,9 +263,13 @@ def init_db_and_migrate():
       id INTEGER PRIMARY KEY AUTOINCREMENT,
       username TEXT NOT NULL UNIQUE,
       password_hash TEXT NOT NULL,
-      created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+      created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+      books_rev INTEGER NOT NULL DEFAULT 0
     )
     """)
+    # 既存DB向け：蔵書の版番号（ETag用。books への書き込みのたびにトリガーで +1）
+    if "books_rev" not in table_columns(cur, "users"):
+        cur.execute("ALTER TABLE users ADD COLUMN books_rev INTEGER NOT NULL DEFAULT 0")
 
     # books（ユーザー分離 + status + メタデータ）
     cur.execute("""
@@ -95,31 +293,62 @@ def init_db_and_migrate():
     """)
 
     # 既存DB向け：足りないカラムを追加
-    # （すでに存在するなら何もしません）
+    # （すでに存在するなら何もしません。PRAGMA は1回だけ引いて集合で判定）
+    existing = table_columns(cur, "books")
+    tables = existing_tables(cur)
     # user_id
-    if not column_exists(cur, "books", "user_id"):
+    if "user_id" not in existing:
         # 既存DBに user_id がない場合の救済：後で admin に紐付けます
         cur.execute("ALTER TABLE books ADD COLUMN user_id INTEGER")
     # status
-    if not column_exists(cur, "books", "status"):
+    if "status" not in existing:
         cur.execute("ALTER TABLE books ADD COLUMN status TEXT NOT NULL DEFAULT '未読'")
     # cover_url
-    if not column_exists(cur, "books", "cover_url"):
+    if "cover_url" not in existing:
         cur.execute("ALTER TABLE books ADD COLUMN cover_url TEXT")
     # source
-    if not column_exists(cur, "books", "source"):
+    if "source" not in existing:
         cur.execute("ALTER TABLE books ADD COLUMN source TEXT")
     # meta_json
-    if not column_exists(cur, "books", "meta_json"):
+    if "meta_json" not in existing:
         cur.execute("ALTER TABLE books ADD COLUMN meta_json TEXT")
     # created_at / updated_at
-    if not column_exists(cur, "books", "created_at"):
+    if "created_at" not in existing:
         cur.execute("ALTER TABLE books ADD COLUMN created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP")
-    if not column_exists(cur, "books", "updated_at"):
+    if "updated_at" not in existing:
         cur.execute("ALTER TABLE books ADD COLUMN updated_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP")
 
+    # books が変わったら同じトランザクション内で持ち主の books_rev を進める
+    # （updated_at は秒単位なので、同じ秒の2回目の変更を ETag で見分けられない）
+    cur.execute("""
+    CREATE TRIGGER IF NOT EXISTS books_rev_ai AFTER INSERT ON books BEGIN
+      UPDATE users SET books_rev = books_rev + 1 WHERE id = new.user_id;
+    END
+    """)
+    cur.execute("""
+    CREATE TRIGGER IF NOT EXISTS books_rev_au AFTER UPDATE ON books BEGIN
+      UPDATE users SET books_rev = books_rev + 1 WHERE id IN (old.user_id, new.user_id);
+    END
+    """)
+    cur.execute("""
+    CREATE TRIGGER IF NOT EXISTS books_rev_ad AFTER DELETE ON books BEGIN
+      UPDATE users SET books_rev = books_rev + 1 WHERE id = old.user_id;
+    END
+    """)
+
+    # 一覧（user_id で絞って updated_at, id 降順）をインデックスだけで返せるように
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_books_user_updated ON books(user_id, updated_at DESC, id DESC)")
+    # スキャン時の (user_id, isbn) 存在チェック用。同じ本の二重登録も防ぐ
+    try:
+        cur.execute(
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_books_user_isbn ON books(user_id, isbn) WHERE isbn IS NOT NULL"
+        )
+    except sqlite3.IntegrityError:
+        # 既存DBに重複がある場合は一意制約なしで作る（データは消さない）
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_books_user_isbn ON books(user_id, isbn)")
+
     # 場所履歴
-    if not table_exists(cur, "book_locations"):
+    if "book_locations" not in tables:
         cur.execute("""
         CREATE TABLE book_locations (
           id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -133,6 +362,25 @@ def init_db_and_migrate():
         """)
         cur.execute("CREATE INDEX IF NOT EXISTS idx_book_locations_book ON book_locations(book_id)")
         cur.execute("CREATE INDEX IF NOT EXISTS idx_book_locations_user ON book_locations(user_id)")
+    # 詳細ページの履歴（book_id, user_id で絞って id 降順）をソートなしで返す
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_book_locations_book_user ON book_locations(book_id, user_id)")
+
+    # 全文検索（title/authors/tags/isbn）。trigram なので日本語も部分一致で引けます
+    global HAS_FTS
+    HAS_FTS = _create_books_fts(cur, tables)
+
+    # ISBNメタデータのキャッシュ（ユーザー共通。外部APIへの重複問い合わせを省く）
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS book_metadata_cache (
+      isbn TEXT PRIMARY KEY,
+      title TEXT NOT NULL,
+      authors TEXT,
+      cover_url TEXT,
+      source TEXT,
+      meta_json TEXT,
+      fetched_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
 
     db.commit()
 
@@ -152,34 +400,86 @@ def init_db_and_migrate():
 init_db_and_migrate()
 
 
+# =========================================================
+# Security: passwords
+# =========================================================
+# argon2id（C実装でGILを離す）。旧来の Werkzeug(PBKDF2) ハッシュもログイン時に検証し、そのまま argon2 に更新します
+_password_hasher = PasswordHasher(time_cost=2, memory_cost=19456, parallelism=1)
+
+
+def hash_password(password: str) -> str:
+    return _password_hasher.hash(password)
+
+
+def verify_password(stored: str, password: str) -> bool:
+    if stored.startswith("$argon2"):
+        try:
+            return _password_hasher.verify(stored, password)
+        except (VerificationError, InvalidHashError):
+            return False
+    return check_password_hash(stored, password)
+
+
+def password_needs_rehash(stored: str) -> bool:
+    if not stored.startswith("$argon2"):
+        return True
+    return _password_hasher.check_needs_rehash(stored)
+
+
 # =========================================================
 # Security: CSRF
 # =========================================================
 def get_csrf() -> str:
-    tok = session.get("csrf_token")
-    if not tok:
-        tok = secrets.token_urlsafe(24)
-        session["csrf_token"] = tok
+    # リクエスト中は g に持ち、セッションを読むのは1回だけ（書くのは新規発行時のみ）
+    tok = g.get("csrf_token")
+    if tok is None:
+        tok = session.get("csrf_token")
+        if not tok:
+            tok = secrets.token_urlsafe(24)
+            session["csrf_token"] = tok
+        g.csrf_token = tok
     return tok
 
 
 def require_csrf():
     if request.method == "POST":
         sent = request.form.get("csrf_token", "")
-        if not sent or sent != session.get("csrf_token"):
+        expected = g.get("csrf_token") or session.get("csrf_token") or ""
+        if not sent or not expected or not hmac.compare_digest(sent.encode(), expected.encode()):
             abort(400, description="Bad CSRF token")
 
 
-@app.before_request
-def _csrf_guard():
-    # GET等は対象外、POSTのみ
-    if request.method == "POST":
+def csrf_protect(fn):
+    """
+    フォームを受け取るルートにだけ付ける（POSTのときトークンを検証）。
+    """
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
         require_csrf()
+        return fn(*args, **kwargs)
+    return wrapper
+
+
+class _LazyCsrfToken:
+    """
+    テンプレートで {{ csrf_token }} が実際に描画されたときだけトークンを用意します。
+    フォームの無いページ（/health など）ではセッションに触れません。
+    """
+    def __str__(self) -> str:
+        return get_csrf()
+
+    __html__ = __str__
+
+    def __call__(self) -> str:
+        return get_csrf()
+
+
+_lazy_csrf_token = _LazyCsrfToken()
 
 
 @app.context_processor
 def inject_csrf():
-    return {"csrf_token": get_csrf()}
+    return {"csrf_token": _lazy_csrf_token}
 
 
 def login_required(fn):
@@ -195,6 +495,7 @@ def login_required(fn):
 # Auth routes
 # =========================================================
 @app.route("/register", methods=["GET", "POST"])
+@csrf_protect
 def register():
     if request.method == "POST":
         username = (request.form.get("username") or "").strip()
@@ -203,21 +504,22 @@ def register():
             flash("ユーザー名とパスワードは必須です。")
             return render_template("register.html", title="新規登録")
 
-        db = get_db()
+        db = get_db_rw()
         try:
-            db.execute(
+            cur = db.execute(
                 "INSERT INTO users(username, password_hash) VALUES(?, ?)",
-                (username, generate_password_hash(password))
+                (username, hash_password(password))
             )
             db.commit()
         except sqlite3.IntegrityError:
+            db.rollback()
             flash("そのユーザー名は既に使われています。")
             return render_template("register.html", title="新規登録")
 
-        # 自動ログイン
-        row = db.execute("SELECT id, username FROM users WHERE username=?", (username,)).fetchone()
-        session["user_id"] = row["id"]
-        session["username"] = row["username"]
+        # 自動ログイン（セッション固定攻撃を防ぐため、認証後はセッションIDを振り直す）
+        app.session_interface.regenerate(session)
+        session["user_id"] = cur.lastrowid
+        session["username"] = username
         get_csrf()  # token確保
         flash("登録しました。")
         return redirect(url_for("index"))
@@ -226,17 +528,29 @@ def register():
 
 
 @app.route("/login", methods=["GET", "POST"])
+@csrf_protect
 def login():
     if request.method == "POST":
         username = (request.form.get("username") or "").strip()
         password = request.form.get("password") or ""
 
-        db = get_db()
+        db = get_db_ro()
         user = db.execute("SELECT * FROM users WHERE username=?", (username,)).fetchone()
-        if not user or not check_password_hash(user["password_hash"], password):
+        if not user or not verify_password(user["password_hash"], password):
             flash("ユーザー名またはパスワードが違います。")
             return render_template("login.html", title="ログイン")
 
+        # 旧形式/旧パラメータのハッシュは、平文が手元にある今のうちに更新
+        if password_needs_rehash(user["password_hash"]):
+            rw = get_db_rw()
+            with rw:
+                rw.execute(
+                    "UPDATE users SET password_hash=? WHERE id=?",
+                    (hash_password(password), user["id"])
+                )
+
+        # セッション固定攻撃を防ぐため、認証後はセッションIDを振り直す
+        app.session_interface.regenerate(session)
         session["user_id"] = user["id"]
         session["username"] = user["username"]
         get_csrf()
@@ -248,6 +562,7 @@ def login():
 
 @app.route("/logout", methods=["POST"])
 @login_required
+@csrf_protect
 def logout():
     session.clear()
     flash("ログアウトしました。")
@@ -257,44 +572,108 @@ def logout():
 # =========================================================
 # Books: list / add / detail / edit
 # =========================================================
+def _deploy_version() -> str:
+    """
+    デプロイの版。APP_VERSION があればそれ、無ければ app.py とテンプレートの更新時刻・サイズから作ります
+    （同じデプロイならワーカー間で同じ値になる）。
+    """
+    env = os.environ.get("APP_VERSION")
+    if env:
+        return env
+    files = [Path(__file__)] + sorted((BASE_DIR / "templates").glob("**/*"))
+    stats = [(str(p), p.stat().st_mtime_ns, p.stat().st_size) for p in files if p.is_file()]
+    return hashlib.blake2b(repr(stats).encode(), digest_size=8).hexdigest()
+
+
+# 起動時に1回だけ決める（テンプレートや画面が変わったデプロイで古い 304 を返さないため）
+DEPLOY_VERSION = _deploy_version()
+
+
+def _page_etag(*parts) -> str:
+    """
+    ページの版を表すETag。URL（検索語・ページ位置）とCSRFトークン（フォームに埋まる）、
+    デプロイの版も混ぜます。
+    """
+    key = "|".join(str(p) for p in (DEPLOY_VERSION, request.full_path, get_csrf()) + parts)
+    return hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+
+
+def _not_modified(etag: str):
+    """
+    If-None-Match が一致すれば 304 を返します（一致しなければ None）。
+    未表示の flash があるときは描画が必要なので返しません。
+    """
+    if session.get("_flashes") or not request.if_none_match.contains_weak(etag):
+        return None
+    resp = app.response_class(status=304)
+    resp.set_etag(etag, weak=True)
+    return resp
+
+
+def _with_etag(resp, etag: str):
+    resp.set_etag(etag, weak=True)
+    # ブラウザにはキャッシュさせつつ、毎回 ETag で確認させる
+    resp.headers["Cache-Control"] = "private, no-cache"
+    return resp
+
+
 @app.route("/", methods=["GET"])
 @login_required
 def index():
     user_id = session["user_id"]
     q = (request.args.get("q") or "").strip()
 
-    db = get_db()
-    if q:
+    # 前ページ最後の行の (updated_at, id)。両方そろっているときだけ続きから
+    after_updated = request.args.get("after_updated") or ""
+    after_id = request.args.get("after_id", type=int)
+    after = (after_updated, after_id) if after_updated and after_id is not None else ()
+
+    db = get_db_ro()
+
+    # 本が1冊でも追加・更新・削除されれば books_rev が進む（主キーで1行引くだけ）
+    books_rev = db.execute(SQL_USER_BOOKS_REV, (user_id,)).fetchone()[0]
+    etag = _page_etag(user_id, books_rev)
+    not_modified = _not_modified(etag)
+    if not_modified:
+        return not_modified
+
+    # 次ページの有無を知るため1件多めに取る（ページングしないときは全件）
+    limit = (BOOKS_PAGE_SIZE + 1,) if BOOKS_PAGE_SIZE > 0 else (-1,)
+    if q and HAS_FTS and len(q) >= FTS_MIN_QUERY_LEN:
+        # フレーズとして渡す（記号や AND/OR を演算子として解釈させない）
+        match = '"' + q.replace('"', '""') + '"'
+        sql = SQL_SEARCH_BOOKS_FTS_AFTER if after else SQL_SEARCH_BOOKS_FTS
+        rows = db.execute(sql, (user_id, match) + after + limit).fetchall()
+    elif q:
         like = f"%{q}%"
-        rows = db.execute(
-            """
-            SELECT * FROM books
-            WHERE user_id=?
-              AND (
-                title LIKE ?
-                OR authors LIKE ?
-                OR tags LIKE ?
-                OR isbn LIKE ?
-              )
-            ORDER BY updated_at DESC, id DESC
-            """,
-            (user_id, like, like, like, like),
-        ).fetchall()
+        sql = SQL_SEARCH_BOOKS_LIKE_AFTER if after else SQL_SEARCH_BOOKS_LIKE
+        rows = db.execute(sql, (user_id, like, like, like, like) + after + limit).fetchall()
     else:
-        rows = db.execute(
-            """
-            SELECT * FROM books
-            WHERE user_id=?
-            ORDER BY updated_at DESC, id DESC
-            """,
-            (user_id,),
-        ).fetchall()
+        sql = SQL_LIST_BOOKS_AFTER if after else SQL_LIST_BOOKS
+        rows = db.execute(sql, (user_id,) + after + limit).fetchall()
+
+    next_url = None
+    if BOOKS_PAGE_SIZE > 0 and len(rows) > BOOKS_PAGE_SIZE:
+        rows = rows[:BOOKS_PAGE_SIZE]
+        last = rows[-1]
+        next_url = url_for(
+            "index", q=q or None, after_updated=last["updated_at"], after_id=last["id"]
+        )
 
-    return render_template("index.html", books=rows, q=q, title="蔵書一覧")
+    # 描画したHTMLは順次送る。books はリストで渡すこと
+    # （index.html が books|length を使うので、カーソルのままでは描画できない）
+    # ストリーム開始前にセッションが保存されるので、flash は先に取り出しておく
+    # （CSRFトークンは _page_etag で確保済み）
+    get_flashed_messages()
+    resp = app.response_class(
+        stream_template("index.html", books=rows, q=q, next_url=next_url, title="蔵書一覧")
+    )
+    return _with_etag(resp, etag)
 
 
 @app.route("/add", methods=["GET", "POST"])
 @login_required
+@csrf_protect
 def add():
     user_id = session["user_id"]
 
@@ -325,15 +704,24 @@ def add():
             )
             return render_template("add.html", prefill=prefill, title="手動追加")
 
-        db = get_db()
-        db.execute(
-            """
-            INSERT INTO books(user_id, isbn, title, authors, tags, location, notes, status, updated_at)
-            VALUES(?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
-            """,
-            (user_id, isbn or None, title, authors or None, tags or None, location or None, notes or None, status),
-        )
-        db.commit()
+        db = get_db_rw()
+        try:
+            db.execute(
+                """
+                INSERT INTO books(user_id, isbn, title, authors, tags, location, notes, status, updated_at)
+                VALUES(?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+                """,
+                (user_id, isbn or None, title, authors or None, tags or None, location or None, notes or None, status),
+            )
+            db.commit()
+        except sqlite3.IntegrityError:
+            db.rollback()
+            flash("そのISBNは既に登録済みです。")
+            prefill.update(
+                isbn=isbn, title=title, authors=authors, tags=tags,
+                location=location, notes=notes, status=status
+            )
+            return render_template("add.html", prefill=prefill, title="手動追加")
         flash("追加しました。")
         return redirect(url_for("index"))
 
@@ -344,10 +732,14 @@ def add():
 @login_required
 def book(book_id: int):
     user_id = session["user_id"]
-    db = get_db()
+    db = get_db_ro()
+
+    # 版番号は本より先に読む（間に書き込みが入っても「古い版番号 + 新しい中身」にしかならず、
+    # 次回は ETag が変わって取り直される）。場所履歴は edit でしか増えず、そのとき books_rev も進む
+    books_rev = db.execute(SQL_USER_BOOKS_REV, (user_id,)).fetchone()[0]
 
     b_row = db.execute(
-        "SELECT * FROM books WHERE id=? AND user_id=?",
+        SQL_GET_BOOK,
         (book_id, user_id)
     ).fetchone()
     if not b_row:
@@ -355,29 +747,42 @@ def book(book_id: int):
 
     b = dict(b_row)  # ★ これが重要
 
-    history_rows = db.execute(
-        """
-        SELECT location, changed_at
-        FROM book_locations
-        WHERE book_id=? AND user_id=?
-        ORDER BY changed_at DESC, id DESC
-        LIMIT 50
-        """,
-        (book_id, user_id)
-    ).fetchall()
+    etag = _page_etag(user_id, book_id, books_rev)
+    not_modified = _not_modified(etag)
+    if not_modified:
+        return not_modified
+
+    before_id = request.args.get("before_id", type=int)
+    if before_id is not None:
+        history_rows = db.execute(
+            SQL_BOOK_HISTORY_BEFORE, (book_id, user_id, before_id, HISTORY_PAGE_SIZE + 1)
+        ).fetchall()
+    else:
+        history_rows = db.execute(
+            SQL_BOOK_HISTORY, (book_id, user_id, HISTORY_PAGE_SIZE + 1)
+        ).fetchall()
     history = [dict(r) for r in history_rows]  # ★ 念のため
 
-    return render_template("book.html", b=b, history=history, title="詳細")
+    history_next_url = None
+    if len(history) > HISTORY_PAGE_SIZE:
+        history = history[:HISTORY_PAGE_SIZE]
+        history_next_url = url_for("book", book_id=book_id, before_id=history[-1]["id"])
+
+    resp = app.make_response(render_template(
+        "book.html", b=b, history=history, history_next_url=history_next_url, title="詳細"
+    ))
+    return _with_etag(resp, etag)
 
 
 @app.route("/edit/<int:book_id>", methods=["GET", "POST"])
 @login_required
+@csrf_protect
 def edit(book_id: int):
     user_id = session["user_id"]
-    db = get_db()
+    db = get_db_rw()
 
     b_row = db.execute(
-        "SELECT * FROM books WHERE id=? AND user_id=?",
+        SQL_GET_BOOK,
         (book_id, user_id)
     ).fetchone()
     if not b_row:
@@ -404,50 +809,116 @@ def edit(book_id: int):
             )
             return render_template("edit.html", b=b, title="簡易編集")
 
-        db.execute(
-            """
-            UPDATE books
-            SET isbn=?, title=?, authors=?, tags=?, location=?, notes=?, status=?, updated_at=CURRENT_TIMESTAMP
-            WHERE id=? AND user_id=?
-            """,
-            (isbn or None, title, authors or None, tags or None, location or None, notes or None, status, book_id, user_id)
-        )
-
-        new_location = location.strip()
-        if new_location and new_location != old_location:
-            db.execute(
-                "INSERT INTO book_locations(book_id, user_id, location) VALUES(?, ?, ?)",
-                (book_id, user_id, new_location)
+        # UPDATE と場所履歴の INSERT を1トランザクションで（fsyncは1回）
+        try:
+            with db:
+                db.execute(
+                    """
+                    UPDATE books
+                    SET isbn=?, title=?, authors=?, tags=?, location=?, notes=?, status=?, updated_at=CURRENT_TIMESTAMP
+                    WHERE id=? AND user_id=?
+                    """,
+                    (isbn or None, title, authors or None, tags or None, location or None, notes or None, status, book_id, user_id)
+                )
+
+                # 場所履歴：変化したときだけ記録（新しいlocationが空なら記録しない）
+                new_location = location.strip()
+                if new_location and new_location != old_location:
+                    db.execute(
+                        "INSERT INTO book_locations(book_id, user_id, location) VALUES(?, ?, ?)",
+                        (book_id, user_id, new_location)
+                    )
+        except sqlite3.IntegrityError:
+            flash("そのISBNは既に登録済みです。")
+            b.update(
+                isbn=isbn, title=title, authors=authors, tags=tags,
+                location=location, notes=notes, status=status
             )
+            return render_template("edit.html", b=b, title="簡易編集")
 
-        db.commit()
         flash("保存しました。")
         return redirect(url_for("book", book_id=book_id))
 
     return render_template("edit.html", b=b, title="簡易編集")
 
-    db.execute(
-            """
-            UPDATE books
-            SET isbn=?, title=?, authors=?, tags=?, location=?, notes=?, status=?, updated_at=CURRENT_TIMESTAMP
-            WHERE id=? AND user_id=?
+
+# =========================================================
+# Books: bulk import
+# =========================================================
+BULK_BOOK_COLUMNS = ("user_id", "isbn", "title", "authors", "tags", "location", "notes", "status")
+# 複数行 VALUES ... RETURNING は SQLite 3.35 以降。それより古ければ1行ずつ（同じトランザクション内）
+BULK_USE_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+# 3.32 以降のバインド変数上限（32766）に収まる1文あたりの行数
+BULK_CHUNK_ROWS = 32766 // len(BULK_BOOK_COLUMNS)
+
+_SQL_BULK_INSERT_BOOK = f"""
+INSERT OR IGNORE INTO books({", ".join(BULK_BOOK_COLUMNS)})
+VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+
+def _bulk_insert_chunk(db: sqlite3.Connection, chunk: list) -> list:
+    """
+    chunk を INSERT OR IGNORE し、実際に入った行の (id, location) を返します。
+    """
+    if not BULK_USE_RETURNING:
+        new_rows = []
+        for row in chunk:
+            cur = db.execute(_SQL_BULK_INSERT_BOOK, row)
+            if cur.rowcount:
+                new_rows.append((cur.lastrowid, row[BULK_BOOK_COLUMNS.index("location")]))
+        return new_rows
+
+    placeholders = ", ".join(["(?, ?, ?, ?, ?, ?, ?, ?)"] * len(chunk))
+    return [
+        (r["id"], r["location"])
+        for r in db.execute(
+            f"""
+            INSERT OR IGNORE INTO books({", ".join(BULK_BOOK_COLUMNS)})
+            VALUES {placeholders}
+            RETURNING id, location
             """,
-            (isbn or None, title, authors or None, tags or None, location or None, notes or None, status, book_id, user_id)
+            [v for row in chunk for v in row],
         )
+    ]
 
-        # 場所履歴：変化したときだけ記録（新しいlocationが空なら記録しない）
-    new_location = location.strip()
-    if new_location and new_location != old_location:
-            db.execute(
+
+def bulk_upsert_books(user_id: int, rows) -> int:
+    """
+    rows（isbn/title/authors/tags/location/notes/status を持つ dict の列）をまとめて登録します。
+    全体を1トランザクションで入れるので fsync は1回。追加した件数を返します。
+    INSERT OR IGNORE なので、idx_books_user_isbn が一意インデックスとして作れていれば
+    同じISBNの本は飛ばします（既存DBの重複で非一意になっている場合はそのまま入ります）。
+    場所があるものは book_locations にも初回の記録を残します。
+    """
+    values = []
+    for r in rows:
+        title = (r.get("title") or "").strip()
+        if not title:
+            continue
+        values.append((
+            user_id,
+            (r.get("isbn") or "").strip() or None,
+            title,
+            (r.get("authors") or "").strip() or None,
+            (r.get("tags") or "").strip() or None,
+            (r.get("location") or "").strip() or None,
+            (r.get("notes") or "").strip() or None,
+            (r.get("status") or "未読").strip() or "未読",
+        ))
+
+    db = get_db_rw()
+    inserted = 0
+    with db:
+        for start in range(0, len(values), BULK_CHUNK_ROWS):
+            new_rows = _bulk_insert_chunk(db, values[start:start + BULK_CHUNK_ROWS])
+            inserted += len(new_rows)
+
+            db.executemany(
                 "INSERT INTO book_locations(book_id, user_id, location) VALUES(?, ?, ?)",
-                (book_id, user_id, new_location)
+                [(book_id, user_id, location) for book_id, location in new_rows if location],
             )
-
-    db.commit()
-    flash("保存しました。")
-    return redirect(url_for("book", book_id=book_id))
-
-    return render_template("edit.html", b=b, title="簡易編集")
+    return inserted
 
 
 # =========================================================
@@ -460,91 +931,213 @@ def scan():
     code = (request.args.get("code") or "").strip()
     found = None
     if code:
-        db = get_db()
+        db = get_db_ro()
         found = db.execute(
-            "SELECT * FROM books WHERE user_id=? AND isbn=?",
+            SQL_FIND_BOOK_BY_ISBN,
             (user_id, code)
         ).fetchone()
 
     return render_template("scan.html", code=code, found=found, title="スキャン")
 
 
-def _http_get_json(url: str, timeout: int = 7):
-    req = urllib.request.Request(
-        url,
-        headers={"User-Agent": "home-library/1.0 (+https://example.invalid)"}
+def _make_http_session() -> requests.Session:
+    """
+    外部API用の共有セッション。ホストごとにTCP/TLS接続を使い回し（keep-alive）、
+    一時的なエラーは軽くリトライします。
+    """
+    sess = requests.Session()
+    sess.headers["User-Agent"] = "home-library/1.0 (+https://example.invalid)"
+    adapter = HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=16,
+        max_retries=Retry(total=2, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504]),
     )
-    with urllib.request.urlopen(req, timeout=timeout) as resp:
-        data = resp.read().decode("utf-8")
-        return json.loads(data)
+    sess.mount("https://", adapter)
+    sess.mount("http://", adapter)
+    return sess
 
 
-def fetch_book_metadata_by_isbn(isbn: str):
-    """
-    OpenLibrary → ダメならGoogle Books。
-    返す dict には title/authors/cover_url/source/meta_json を入れる。
-    """
-    isbn = isbn.replace("-", "").strip()
-    if not isbn:
-        return None
+_http = _make_http_session()
+
+
+def _http_get_json(url: str, timeout: int = 7):
+    resp = _http.get(url, timeout=timeout)
+    resp.raise_for_status()
+    return resp.json()
+
 
-    # 1) OpenLibrary
+# 外部APIはネットワーク待ちが支配的なので、スレッドで並行に投げる
+# （プロバイダ用と著者用でプールを分け、入れ子の待ちでデッドロックしないようにする）
+_PROVIDER_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix="meta-provider")
+_AUTHOR_POOL = ThreadPoolExecutor(max_workers=16, thread_name_prefix="meta-author")
+
+
+def _fetch_openlibrary_author(key: str) -> str:
+    try:
+        ad = _http_get_json(f"https://openlibrary.org{key}.json")
+        return (ad.get("name") or "").strip()
+    except Exception:
+        return ""
+
+
+def _fetch_from_openlibrary(isbn: str):
     try:
         ol_url = f"https://openlibrary.org/isbn/{urllib.parse.quote(isbn)}.json"
         ol = _http_get_json(ol_url)
         title = (ol.get("title") or "").strip()
-
-        authors_list = []
-        for a in (ol.get("authors") or []):
-            key = a.get("key")
-            if key:
-                try:
-                    ad = _http_get_json(f"https://openlibrary.org{key}.json")
-                    name = (ad.get("name") or "").strip()
-                    if name:
-                        authors_list.append(name)
-                except Exception:
-                    pass
-
-        cover_url = f"https://covers.openlibrary.org/b/isbn/{isbn}-L.jpg"
-
-        if title:
-            return {
-                "isbn": isbn,
-                "title": title,
-                "authors": ", ".join(authors_list) if authors_list else "",
-                "cover_url": cover_url,
-                "source": "openlibrary",
-                "meta_json": json.dumps(ol, ensure_ascii=False),
-            }
+        if not title:
+            return None
+
+        # 著者は1件ずつではなくまとめて並行取得（順序は維持）
+        keys = [a.get("key") for a in (ol.get("authors") or []) if a.get("key")]
+        authors_list = [name for name in _AUTHOR_POOL.map(_fetch_openlibrary_author, keys) if name]
+
+        return {
+            "isbn": isbn,
+            "title": title,
+            "authors": ", ".join(authors_list) if authors_list else "",
+            "cover_url": f"https://covers.openlibrary.org/b/isbn/{isbn}-L.jpg",
+            "source": "openlibrary",
+            "meta_json": json.dumps(ol, ensure_ascii=False),
+        }
     except Exception:
-        pass
+        return None
 
-    # 2) Google Books
+
+def _fetch_from_googlebooks(isbn: str):
     try:
         gb_url = "https://www.googleapis.com/books/v1/volumes?q=" + urllib.parse.quote(f"isbn:{isbn}")
         gb = _http_get_json(gb_url)
         items = gb.get("items") or []
-        if items:
-            vi = (items[0].get("volumeInfo") or {})
-            title = (vi.get("title") or "").strip()
-            authors = vi.get("authors") or []
-            image_links = vi.get("imageLinks") or {}
-            cover_url = image_links.get("thumbnail") or image_links.get("smallThumbnail") or ""
-
-            if title:
-                return {
-                    "isbn": isbn,
-                    "title": title,
-                    "authors": ", ".join(authors) if authors else "",
-                    "cover_url": cover_url,
-                    "source": "googlebooks",
-                    "meta_json": json.dumps(items[0], ensure_ascii=False),
-                }
+        if not items:
+            return None
+
+        vi = (items[0].get("volumeInfo") or {})
+        title = (vi.get("title") or "").strip()
+        if not title:
+            return None
+
+        authors = vi.get("authors") or []
+        image_links = vi.get("imageLinks") or {}
+        cover_url = image_links.get("thumbnail") or image_links.get("smallThumbnail") or ""
+        return {
+            "isbn": isbn,
+            "title": title,
+            "authors": ", ".join(authors) if authors else "",
+            "cover_url": cover_url,
+            "source": "googlebooks",
+            "meta_json": json.dumps(items[0], ensure_ascii=False),
+        }
     except Exception:
-        pass
+        return None
+
+
+def fetch_book_metadata_by_isbn(isbn: str):
+    """
+    OpenLibrary → ダメならGoogle Books。
+    両方を同時に問い合わせ、待ち時間は「合計」ではなく「最大」になります。
+    返す dict には title/authors/cover_url/source/meta_json を入れる。
+    """
+    isbn = isbn.replace("-", "").strip()
+    if not isbn:
+        return None
 
-    return None
+    ol_future = _PROVIDER_POOL.submit(_fetch_from_openlibrary, isbn)
+    gb_future = _PROVIDER_POOL.submit(_fetch_from_googlebooks, isbn)
+
+    # 優先順位は従来どおり OpenLibrary が先
+    return ol_future.result() or gb_future.result()
+
+
+# キャッシュの有効期限（日）。L1/L2 とも同じ期限で捨てる
+META_CACHE_TTL_DAYS = 30
+META_CACHE_TTL_SECONDS = META_CACHE_TTL_DAYS * 24 * 60 * 60
+META_CACHE_MAX_ENTRIES = 4096
+
+# L1: isbn -> (期限のepoch秒, meta)。古い順に追い出す
+_meta_l1: "OrderedDict[str, tuple]" = OrderedDict()
+_meta_l1_lock = threading.Lock()
+
+
+def _meta_l1_get(isbn: str):
+    with _meta_l1_lock:
+        hit = _meta_l1.get(isbn)
+        if hit is None:
+            return None
+        expires, meta = hit
+        if expires <= time.time():
+            del _meta_l1[isbn]
+            return None
+        _meta_l1.move_to_end(isbn)
+        return meta
+
+
+def _meta_l1_put(isbn: str, expires: float, meta: dict) -> None:
+    with _meta_l1_lock:
+        _meta_l1[isbn] = (expires, meta)
+        _meta_l1.move_to_end(isbn)
+        while len(_meta_l1) > META_CACHE_MAX_ENTRIES:
+            _meta_l1.popitem(last=False)
+
+
+def _lookup_isbn(isbn: str):
+    """
+    L1: プロセス内 / L2: book_metadata_cache テーブル / それでも無ければ外部API。
+    L1 の期限は L2 の fetched_at から数えるので、どちらも TTL を超えて使われません。
+    見つからないときは None（失敗はキャッシュせず、次回また問い合わせます）。
+    """
+    meta = _meta_l1_get(isbn)
+    if meta is not None:
+        return meta
+
+    db = get_db_rw()
+    row = db.execute(
+        """
+        SELECT isbn, title, authors, cover_url, source, meta_json,
+               CAST(strftime('%s', fetched_at) AS INTEGER) AS fetched_epoch
+        FROM book_metadata_cache
+        WHERE isbn=? AND fetched_at >= datetime('now', ?)
+        """,
+        (isbn, f"-{META_CACHE_TTL_DAYS} days")
+    ).fetchone()
+    if row:
+        meta = dict(row)
+        fetched_epoch = meta.pop("fetched_epoch")
+        _meta_l1_put(isbn, fetched_epoch + META_CACHE_TTL_SECONDS, meta)
+        return meta
+
+    meta = fetch_book_metadata_by_isbn(isbn)
+    if not meta or not meta.get("title"):
+        return None
+
+    with db:
+        db.execute(
+            """
+            INSERT OR REPLACE INTO book_metadata_cache(isbn, title, authors, cover_url, source, meta_json, fetched_at)
+            VALUES(?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+            """,
+            (
+                isbn,
+                meta.get("title"),
+                meta.get("authors") or None,
+                meta.get("cover_url") or None,
+                meta.get("source") or None,
+                meta.get("meta_json") or None,
+            )
+        )
+    _meta_l1_put(isbn, time.time() + META_CACHE_TTL_SECONDS, meta)
+    return meta
+
+
+def lookup_book_metadata(isbn: str):
+    """
+    キャッシュ経由で fetch_book_metadata_by_isbn と同じ dict を返します（無ければ None）。
+    """
+    isbn = isbn.replace("-", "").strip()
+    if not isbn:
+        return None
+    meta = _lookup_isbn(isbn)
+    return dict(meta) if meta else None
 
 
 @app.route("/scan_auto_add", methods=["GET"])
@@ -561,40 +1154,52 @@ def scan_auto_add():
         flash("code がありません。")
         return redirect(url_for("scan"))
 
-    db = get_db()
+    db = get_db_rw()
 
     # 既に登録済みなら詳細へ
     ex = db.execute(
-        "SELECT id FROM books WHERE user_id=? AND isbn=?",
+        SQL_FIND_BOOK_ID_BY_ISBN,
         (user_id, code)
     ).fetchone()
     if ex:
         flash("既に登録済みです。")
         return redirect(url_for("book", book_id=ex["id"]))
 
-    meta = fetch_book_metadata_by_isbn(code)
+    meta = lookup_book_metadata(code)
     if not meta or not meta.get("title"):
         flash("自動取得に失敗しました。手動追加へ進みます。")
         return redirect(url_for("add", isbn=code))
 
-    db.execute(
-        """
-        INSERT INTO books(user_id, isbn, title, authors, status, cover_url, source, meta_json, updated_at)
-        VALUES(?, ?, ?, ?, '未読', ?, ?, ?, CURRENT_TIMESTAMP)
-        """,
-        (
-            user_id,
-            meta.get("isbn") or code,
-            meta.get("title"),
-            meta.get("authors") or None,
-            meta.get("cover_url") or None,
-            meta.get("source") or None,
-            meta.get("meta_json") or None,
-        )
-    )
-    db.commit()
+    # メタデータ取得（ネットワーク）中はロックを握らないよう、INSERTだけをトランザクションに
+    try:
+        with db:
+            cur = db.execute(
+                """
+                INSERT INTO books(user_id, isbn, title, authors, status, cover_url, source, meta_json, updated_at)
+                VALUES(?, ?, ?, ?, '未読', ?, ?, ?, CURRENT_TIMESTAMP)
+                """,
+                (
+                    user_id,
+                    meta.get("isbn") or code,
+                    meta.get("title"),
+                    meta.get("authors") or None,
+                    meta.get("cover_url") or None,
+                    meta.get("source") or None,
+                    meta.get("meta_json") or None,
+                )
+            )
+    except sqlite3.IntegrityError:
+        # 取得中に別リクエストが同じISBNを登録した（idx_books_user_isbn）
+        ex = db.execute(
+            SQL_FIND_BOOK_ID_BY_ISBN,
+            (user_id, meta.get("isbn") or code)
+        ).fetchone()
+        if not ex:
+            raise
+        flash("既に登録済みです。")
+        return redirect(url_for("book", book_id=ex["id"]))
 
-    new_id = db.execute("SELECT last_insert_rowid() AS id").fetchone()["id"]
+    new_id = cur.lastrowid
     flash("自動取得して追加しました。")
     return redirect(url_for("book", book_id=new_id))
 
@@ -602,9 +1207,15 @@ def scan_auto_add():
 # =========================================================
 # (Optional) Health check
 # =========================================================
+@functools.lru_cache(maxsize=1)
+def _utc_iso_second(sec: int) -> str:
+    # 同じ秒の間は整形済み文字列を使い回す
+    return datetime.fromtimestamp(sec, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
 @app.route("/health")
 def health():
-    return {"ok": True, "time": datetime.utcnow().isoformat() + "Z"}
+    return {"ok": True, "time": _utc_iso_second(int(time.time()))}
 
 
 if __name__ == "__main__":
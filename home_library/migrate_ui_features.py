@@ -3,13 +3,11 @@ from pathlib import Path
 
 DB_PATH = Path(__file__).parent / "library.db"
 
-def column_exists(cur, table: str, col: str) -> bool:
-    cur.execute(f"PRAGMA table_info({table})")
-    return any(row[1] == col for row in cur.fetchall())
+def table_columns(cur, table: str) -> set:
+    return {row[1] for row in cur.execute(f"PRAGMA table_info({table})")}
 
-def table_exists(cur, table: str) -> bool:
-    cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (table,))
-    return cur.fetchone() is not None
+def existing_tables(cur) -> set:
+    return {row[0] for row in cur.execute("SELECT name FROM sqlite_master WHERE type='table'")}
 
 def main():
     if not DB_PATH.exists():
@@ -18,9 +16,11 @@ def main():
     con = sqlite3.connect(DB_PATH)
     con.row_factory = sqlite3.Row
     cur = con.cursor()
+    columns = table_columns(cur, "books")
+    tables = existing_tables(cur)
 
     # 1) books.status を追加（未読をデフォルト）
-    if not column_exists(cur, "books", "status"):
+    if "status" not in columns:
         cur.execute("ALTER TABLE books ADD COLUMN status TEXT NOT NULL DEFAULT '未読'")
         print("Added column: books.status")
     else:
@@ -28,7 +28,7 @@ def main():
 
     # 2) 場所履歴テーブルを追加
     # ※ user_id が books にある前提（あなたはB達成と言っているので）
-    if not table_exists(cur, "book_locations"):
+    if "book_locations" not in tables:
         cur.execute("""
         CREATE TABLE book_locations (
           id INTEGER PRIMARY KEY AUTOINCREMENT,